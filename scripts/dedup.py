@@ -0,0 +1,280 @@
+import re
+import unicodedata
+
+import faiss
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.97  # Cosine similarity above which two papers are the same work
+NUM_CANDIDATES = 5  # Nearest neighbours checked per paper
+MAX_YEAR_SPAN = 3  # Preprint and published versions rarely lie further apart
+IVF_MIN_PAPERS = 50000  # Below this an exact flat scan is cheap enough
+BATCH_SIZE = 4096
+VERSION_FIELDS = ["id", "title", "authors", "author", "doi", "venue", "year", "url"]
+
+
+def normalize_doi(doi):
+    if not doi:
+        return None
+    doi = doi.strip().lower()
+    doi = re.sub(r"^(https?://)?(dx\.)?doi\.org/", "", doi)
+    doi = re.sub(r"^doi:\s*", "", doi)
+    return doi or None
+
+
+def normalize_title(title):
+    if not title:
+        return None
+    # Fold accents so "Über" matches "Uber" instead of losing the letter
+    title = unicodedata.normalize("NFKD", title)
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = re.sub(r"[^a-z0-9]+", " ", title.lower())
+    return " ".join(title.split()) or None
+
+
+def first_author_surname(paper):
+    """
+    Accepts "authors" as a list or a comma/"and"-separated string, or a single "author".
+    Names may be "First Last" or "Last, First".
+    """
+    authors = paper.get("authors") or paper.get("author")
+    if not authors:
+        return None
+
+    if isinstance(authors, str):
+        if ";" in authors:
+            authors = authors.split(";")
+        elif " and " in authors:
+            authors = authors.split(" and ")
+        else:
+            authors = [authors]
+    first = str(authors[0])
+
+    if "," in first:
+        surname = first.split(",")[0]
+    else:
+        surname = first.split()[-1] if first.split() else ""
+    return normalize_title(surname)
+
+
+def parse_year(year):
+    try:
+        return int(str(year)[:4])
+    except (TypeError, ValueError):
+        return None
+
+
+class UnionFind:
+    """
+    Groups papers while keeping every group consistent with its metadata:
+    a group holds at most one DOI and spans at most MAX_YEAR_SPAN years,
+    so single-linkage chains cannot join distinct published works.
+    """
+
+    def __init__(self, papers):
+        self.parent = list(range(len(papers)))
+        self.doi = [normalize_doi(paper.get("doi")) for paper in papers]
+        self.years = []
+        for paper in papers:
+            year = parse_year(paper.get("year"))
+            self.years.append(None if year is None else (year, year))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        """Merges the groups of a and b; returns False if their metadata conflicts."""
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return True
+
+        doi_a, doi_b = self.doi[ra], self.doi[rb]
+        if doi_a and doi_b and doi_a != doi_b:
+            return False
+
+        years = self.years[ra]
+        if years is None:
+            years = self.years[rb]
+        elif self.years[rb] is not None:
+            years = (min(years[0], self.years[rb][0]), max(years[1], self.years[rb][1]))
+            if years[1] - years[0] > MAX_YEAR_SPAN:
+                return False
+
+        root, child = min(ra, rb), max(ra, rb)
+        self.parent[child] = root
+        self.doi[root] = doi_a or doi_b
+        self.years[root] = years
+        return True
+
+    def groups(self):
+        groups = {}
+        for i in range(len(self.parent)):
+            groups.setdefault(self.find(i), []).append(i)
+        return list(groups.values())
+
+
+def group_by_keys(papers):
+    """
+    papers: list of dicts
+    returns: lists of indices into papers that share a normalized DOI or title
+
+    A DOI is authoritative: papers with different DOIs are never merged.
+    A title only counts together with the first author's surname, so generic
+    titles ("Introduction", "Preface", ...) from different authors stay apart;
+    papers without authors are left to the embedding stage. Titles shared by
+    several DOIs are ambiguous and never used as a key.
+    """
+    titles = [normalize_title(paper.get("title")) for paper in papers]
+    surnames = [first_author_surname(paper) for paper in papers]
+
+    title_dois = {}
+    for title, paper in zip(titles, papers):
+        doi = normalize_doi(paper.get("doi"))
+        if title is not None and doi is not None:
+            title_dois.setdefault(title, set()).add(doi)
+
+    uf = UnionFind(papers)
+    # One member per group already holding the key: when a union is refused
+    # (e.g. years too far apart) later papers can still join the other groups
+    seen = {}
+
+    for i, (title, surname, doi) in enumerate(zip(titles, surnames, uf.doi)):
+        keys = []
+        if doi is not None:
+            keys.append(("doi", doi))
+        if title is not None and surname is not None and len(title_dois.get(title, ())) <= 1:
+            keys.append(("title", title, surname))
+
+        for key in keys:
+            members = seen.setdefault(key, [])
+            if not any(uf.union(member, i) for member in members):
+                members.append(i)
+
+    return uf.groups()
+
+
+def group_by_embeddings(embeddings, papers, threshold=SIMILARITY_THRESHOLD, k=NUM_CANDIDATES, query_start=0):
+    """
+    embeddings: numpy array (n, dim)
+    papers: list of n dicts, used to refuse merges across different DOIs or years
+    query_start: only rows from here on look for duplicates (rows before it
+        were already deduplicated against each other)
+    returns: lists of row indices whose embeddings are near-identical
+
+    Each paper is only compared with its k nearest neighbours. Large corpora
+    use an IVF index so the neighbour search never scans all pairs.
+    """
+    if len(papers) == 0:
+        return []
+
+    vectors = np.array(embeddings, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    n, dim = vectors.shape
+
+    if n >= IVF_MIN_PAPERS:
+        nlist = int(4 * np.sqrt(n))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.nprobe = 8
+    else:
+        index = faiss.IndexFlatIP(dim)
+    index.add(vectors)
+
+    uf = UnionFind(papers)
+
+    for start in range(query_start, n, BATCH_SIZE):
+        scores, indices = index.search(vectors[start:start + BATCH_SIZE], k + 1)
+        for row, (row_scores, row_indices) in enumerate(zip(scores, indices), start):
+            for score, idx in zip(row_scores, row_indices):
+                if idx >= 0 and idx != row and score >= threshold:
+                    uf.union(row, int(idx))
+
+    return uf.groups()
+
+
+def pick_canonical(papers, group):
+    """
+    Prefer a published version (has a DOI), then the longest abstract.
+    """
+    return max(
+        group,
+        key=lambda i: (bool(papers[i].get("doi")), len(papers[i].get("abstract") or ""), -i),
+    )
+
+
+def known_keys(papers):
+    """
+    Identity keys of papers and of all their listed versions, used to skip
+    papers that are already in the index when appending.
+    """
+    keys = set()
+    for paper in papers:
+        for version in [paper] + paper.get("versions", []):
+            if version.get("id") is not None:
+                keys.add(("id", str(version["id"])))
+            if normalize_doi(version.get("doi")):
+                keys.add(("doi", normalize_doi(version.get("doi"))))
+            keys.add((
+                "title",
+                normalize_title(version.get("title")),
+                first_author_surname(version),
+                parse_year(version.get("year")),
+            ))
+    return keys
+
+
+def is_known(paper, known):
+    """
+    True if paper is already indexed, given known = known_keys(indexed papers).
+    Titles only identify papers that carry neither an id nor a DOI.
+    """
+    keys = known_keys([paper])
+    if paper.get("id") is not None or normalize_doi(paper.get("doi")):
+        keys = {key for key in keys if key[0] != "title"}
+    return bool(keys & known)
+
+
+def anchor_groups(groups, num_fixed):
+    """
+    Splits groups for an append, where rows below num_fixed are already in the
+    index and must keep their position.
+    returns: (attached, fresh) where attached maps an existing row to the new
+        rows that are versions of it, and fresh lists groups of new rows only
+    """
+    attached = {}
+    fresh = []
+
+    for group in groups:
+        fixed = [i for i in group if i < num_fixed]
+        new = [i for i in group if i >= num_fixed]
+        if not fixed:
+            fresh.append(group)
+        elif new:
+            attached[min(fixed)] = new
+
+    return attached, fresh
+
+
+def collapse(papers, group, canonical=None):
+    """
+    Returns a copy of the canonical paper listing the other members as "versions".
+    canonical defaults to pick_canonical(papers, group).
+    """
+    if canonical is None:
+        canonical = pick_canonical(papers, group)
+    paper = papers[canonical].copy()
+
+    versions = []
+    for i in sorted(group):
+        if i == canonical:
+            continue
+        versions.append({field: papers[i][field] for field in VERSION_FIELDS if papers[i].get(field)})
+        versions.extend(papers[i].get("versions", []))
+
+    if versions:
+        paper["versions"] = paper.get("versions", []) + versions
+
+    return paper
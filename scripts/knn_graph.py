@@ -0,0 +1,213 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings/paper_embeddings.npy"
+NEIGHBORS_FILE = "embeddings/paper_neighbors.npy"
+NEIGHBOR_SCORES_FILE = "embeddings/paper_neighbor_scores.npy"
+NEIGHBORS_META_FILE = "embeddings/paper_neighbors.json"
+NUM_NEIGHBORS = 10
+BLOCK_SIZE = 1024
+NUM_WORKERS = os.cpu_count() or 1
+
+
+def load_embeddings():
+    embeddings = np.array(np.load(EMBEDDINGS_FILE, mmap_mode="r"), dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def embeddings_fingerprint(num_rows=None, chunk_rows=65536):
+    """
+    Hash of the first num_rows rows of EMBEDDINGS_FILE as stored on disk.
+    Appending papers keeps the hash of the old rows; re-encoding or
+    deduplicating the corpus changes it.
+    """
+    raw = np.load(EMBEDDINGS_FILE, mmap_mode="r")
+    num_rows = len(raw) if num_rows is None else num_rows
+
+    digest = hashlib.sha256(str((raw.dtype.str, raw.shape[1:])).encode())
+    for start in range(0, num_rows, chunk_rows):
+        digest.update(np.ascontiguousarray(raw[start:min(start + chunk_rows, num_rows)]).tobytes())
+    return digest.hexdigest()
+
+
+def embeddings_stamp():
+    stat = os.stat(EMBEDDINGS_FILE)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def matches_embeddings(fingerprint, stamp):
+    """
+    True if a file built with (fingerprint, stamp) is current for EMBEDDINGS_FILE.
+    The size/mtime stamp is checked first so servers avoid hashing the
+    embeddings; the hash is only needed when the file was touched or copied.
+    """
+    if list(stamp) == embeddings_stamp():
+        return True
+    return fingerprint == embeddings_fingerprint()
+
+
+def load_graph_meta():
+    with open(NEIGHBORS_META_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def merge_topk(scores, ids, new_scores, new_ids, k):
+    """
+    Merge two candidate lists row by row and keep the k best, sorted by score.
+    """
+    all_scores = np.concatenate([scores, new_scores], axis=1)
+    all_ids = np.concatenate([ids, new_ids], axis=1)
+
+    top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(all_scores, top, axis=1)
+    top_ids = np.take_along_axis(all_ids, top, axis=1)
+
+    order = np.argsort(-top_scores, axis=1)
+    return (
+        np.take_along_axis(top_scores, order, axis=1),
+        np.take_along_axis(top_ids, order, axis=1),
+    )
+
+
+def block_topk(queries, query_offset, corpus, corpus_offset, k, scores=None, ids=None):
+    """
+    queries: normalized vectors (B, dim) whose global rows start at query_offset
+    corpus: normalized vectors (C, dim) whose global rows start at corpus_offset
+    Scans the corpus in BLOCK_SIZE tiles so memory stays at B x BLOCK_SIZE,
+    merging into the running (scores, ids) lists. A paper is never its own neighbour.
+    """
+    if scores is None:
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int32)
+
+    query_rows = np.arange(query_offset, query_offset + len(queries))
+
+    for start in range(0, len(corpus), BLOCK_SIZE):
+        tile = corpus[start:start + BLOCK_SIZE]
+        sims = queries @ tile.T
+
+        tile_rows = np.arange(corpus_offset + start, corpus_offset + start + len(tile), dtype=np.int32)
+        is_self = query_rows[:, None] == tile_rows[None, :]
+        sims[is_self] = -np.inf
+
+        # Self matches look like padding, so they can never surface as a neighbour
+        tile_ids = np.where(is_self, np.int32(-1), tile_rows[None, :])
+        scores, ids = merge_topk(scores, ids, sims, tile_ids, k)
+
+    return scores, ids
+
+
+def run_blocks(num_rows, fn):
+    """
+    Runs fn(start, end) over BLOCK_SIZE row ranges on a thread pool.
+    numpy releases the GIL inside the matrix products, so blocks run in parallel.
+    """
+    starts = range(0, num_rows, BLOCK_SIZE)
+    with ThreadPoolExecutor(max_workers=NUM_WORKERS) as pool:
+        futures = [pool.submit(fn, s, min(s + BLOCK_SIZE, num_rows)) for s in starts]
+        for future in futures:
+            future.result()
+
+
+def save_graph(scores, ids):
+    """
+    Writes both arrays through temporary files and swaps them in, so a server
+    holding the previous files memory-mapped never sees a half-written graph.
+    The fingerprint of the embeddings it was built from is saved alongside.
+    """
+    for path, array in ((NEIGHBORS_FILE, ids), (NEIGHBOR_SCORES_FILE, scores)):
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+    meta = {
+        "rows": len(ids),
+        "fingerprint": embeddings_fingerprint(len(ids)),
+        "stamp": embeddings_stamp(),
+    }
+    tmp_path = NEIGHBORS_META_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, NEIGHBORS_META_FILE)
+
+
+def build_graph(embeddings, k=NUM_NEIGHBORS):
+    n = len(embeddings)
+    ids = np.full((n, k), -1, dtype=np.int32)
+    scores = np.full((n, k), -np.inf, dtype=np.float16)
+
+    def process(start, end):
+        s, i = block_topk(embeddings[start:end], start, embeddings, 0, k)
+        scores[start:end] = s
+        ids[start:end] = i
+
+    run_blocks(n, process)
+    return scores, ids
+
+
+def update_graph(embeddings, k=NUM_NEIGHBORS):
+    """
+    Extends an existing graph after new papers were appended to the embeddings.
+    New rows are scored against the whole corpus; old rows are only compared
+    with the new papers and merged into their stored lists.
+    """
+    old_ids = np.load(NEIGHBORS_FILE)
+    old_scores = np.load(NEIGHBOR_SCORES_FILE).astype(np.float32)
+    n_old = len(old_ids)
+    n = len(embeddings)
+
+    if n_old > n:
+        raise ValueError(f"Graph has {n_old} rows but only {n} embeddings; rebuild it")
+    if not os.path.exists(NEIGHBORS_META_FILE):
+        raise ValueError(f"No fingerprint at {NEIGHBORS_META_FILE}; rebuild it")
+
+    meta = load_graph_meta()
+    if meta["rows"] != n_old or meta["fingerprint"] != embeddings_fingerprint(n_old):
+        raise ValueError("Existing papers were re-encoded or reordered since the last build; rebuild it")
+    if old_ids.shape[1] != k:
+        raise ValueError(f"Graph stores {old_ids.shape[1]} neighbours, not {k}; rebuild it")
+
+    ids = np.full((n, k), -1, dtype=np.int32)
+    scores = np.full((n, k), -np.inf, dtype=np.float16)
+    new_embeddings = embeddings[n_old:]
+
+    def process_old(start, end):
+        s, i = block_topk(
+            embeddings[start:end], start, new_embeddings, n_old, k,
+            old_scores[start:end], old_ids[start:end],
+        )
+        scores[start:end] = s
+        ids[start:end] = i
+
+    def process_new(start, end):
+        s, i = block_topk(embeddings[n_old + start:n_old + end], n_old + start, embeddings, 0, k)
+        scores[n_old + start:n_old + end] = s
+        ids[n_old + start:n_old + end] = i
+
+    run_blocks(n_old, process_old)
+    run_blocks(n - n_old, process_new)
+    return scores, ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the similar-papers graph")
+    parser.add_argument("-k", type=int, default=NUM_NEIGHBORS, help="neighbours per paper")
+    parser.add_argument("--update", action="store_true", help="only add papers appended since the last build")
+    args = parser.parse_args()
+
+    embeddings = load_embeddings()
+
+    if args.update and os.path.exists(NEIGHBORS_FILE):
+        scores, ids = update_graph(embeddings, args.k)
+    else:
+        scores, ids = build_graph(embeddings, args.k)
+
+    save_graph(scores, ids)
+    print("Saved neighbour graph:", ids.shape)
@@ -0,0 +1,128 @@
+import argparse
+
+import faiss
+import numpy as np
+from knn_graph import load_embeddings, embeddings_fingerprint, embeddings_stamp
+
+PCA_FILE = "embeddings/pca_projection.npz"
+REDUCED_EMBEDDINGS_FILE = "embeddings/paper_embeddings_pca.npy"
+TARGET_DIM = 64
+CANDIDATE_DIMS = [16, 32, 64, 128]
+TOP_K = 3  # Results returned per query by search_api.py
+NUM_CANDIDATES = TOP_K * 5  # Candidates search_api.py reranks per query; recall is measured at this depth
+RESCORE_FACTOR = 4  # First-pass candidates per rescored candidate
+NUM_EVAL_QUERIES = 1000
+TRAIN_SAMPLE = 100000
+
+
+def fit_pca(embeddings, dim, seed=0):
+    """
+    Returns (mean, components) with components of shape (dim, full_dim),
+    learned on a random sample so training cost stays flat as the corpus grows.
+    """
+    rng = np.random.default_rng(seed)
+    sample = embeddings
+    if len(embeddings) > TRAIN_SAMPLE:
+        sample = embeddings[rng.choice(len(embeddings), TRAIN_SAMPLE, replace=False)]
+
+    mean = sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    return mean.astype(np.float32), vt[:dim].astype(np.float32)
+
+
+def project(vectors, mean, components):
+    reduced = np.ascontiguousarray((vectors - mean) @ components.T, dtype=np.float32)
+    faiss.normalize_L2(reduced)
+    return reduced
+
+
+def two_stage_search(queries, embeddings, reduced_index, mean, components, k, rescore_factor):
+    """
+    First pass on the reduced index, then rescoring of the candidates
+    with the full-precision vectors. Used both by search_api.py and for the
+    recall report. Returns (scores, ids), one array of up to k per query,
+    sorted by exact inner product.
+    """
+    _, candidates = reduced_index.search(project(queries, mean, components), k * rescore_factor)
+
+    scores, results = [], []
+    for query, ids in zip(queries, candidates):
+        ids = ids[ids >= 0]
+        exact = embeddings[ids] @ query
+        order = np.argsort(-exact)[:k]
+        scores.append(exact[order])
+        results.append(ids[order])
+    return scores, results
+
+
+def evaluate(embeddings, dims, k=NUM_CANDIDATES, rescore_factor=RESCORE_FACTOR, seed=0):
+    """
+    Prints recall@k of the two-stage search against exact search,
+    using a sample of corpus vectors as queries. Each query's own row is
+    dropped from both result lists, since both stages always find it.
+    """
+    rng = np.random.default_rng(seed)
+    n, full_dim = embeddings.shape
+    query_rows = rng.choice(n, min(NUM_EVAL_QUERIES, n), replace=False)
+    queries = embeddings[query_rows]
+
+    def without_self(results):
+        return [ids[ids != row][:k] for row, ids in zip(query_rows, results)]
+
+    exact_index = faiss.IndexFlatIP(full_dim)
+    exact_index.add(embeddings)
+    _, truth = exact_index.search(queries, k + 1)
+    truth = without_self(truth)
+
+    print(f"recall@{k} with {k * rescore_factor} first-pass candidates")
+    print(f"{'dim':>6} {'reduction':>10} {'recall':>8}")
+
+    dims = [dim for dim in dims if dim < full_dim and dim <= n]
+    if not dims:
+        return
+
+    # PCA components are nested, so one fit at the largest dimension serves all of them
+    mean, all_components = fit_pca(embeddings, max(dims), seed)
+
+    for dim in dims:
+        components = all_components[:dim]
+        reduced_index = faiss.IndexFlatIP(dim)
+        reduced_index.add(project(embeddings, mean, components))
+
+        _, found = two_stage_search(queries, embeddings, reduced_index, mean, components, k + 1, rescore_factor)
+        found = without_self(found)
+        hits = sum(len(np.intersect1d(f, t)) for f, t in zip(found, truth))
+        recall = hits / sum(len(t) for t in truth)
+
+        print(f"{dim:>6} {full_dim / dim:>9.1f}x {recall:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the reduced first-pass index for two-stage search")
+    parser.add_argument("--dim", type=int, default=TARGET_DIM, help="target dimension to save")
+    parser.add_argument("--eval-dims", type=int, nargs="*", default=CANDIDATE_DIMS,
+                        help="dimensions to report recall for")
+    args = parser.parse_args()
+
+    embeddings = load_embeddings()
+
+    # PCA yields at most min(papers, dim) components, and must actually reduce the dimension
+    max_dim = min(len(embeddings), embeddings.shape[1] - 1)
+    if not 1 <= args.dim <= max_dim:
+        parser.error(f"--dim must be between 1 and {max_dim} for {embeddings.shape} embeddings")
+
+    if args.eval_dims:
+        evaluate(embeddings, args.eval_dims)
+
+    # The fingerprint lets search_api.py detect embeddings re-encoded after this build
+    mean, components = fit_pca(embeddings, args.dim)
+    np.savez(
+        PCA_FILE,
+        mean=mean,
+        components=components,
+        fingerprint=np.array(embeddings_fingerprint()),
+        stamp=np.array(embeddings_stamp()),
+    )
+    np.save(REDUCED_EMBEDDINGS_FILE, project(embeddings, mean, components))
+
+    print(f"Saved {args.dim}-dim projection of {embeddings.shape[1]}-dim embeddings")
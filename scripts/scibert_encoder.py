@@ -1,8 +1,14 @@
+import argparse
 import json
+import os
 import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModel
 from tqdm import tqdm
+from dedup import (
+    group_by_keys, group_by_embeddings, pick_canonical, collapse,
+    known_keys, is_known, anchor_groups,
+)
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 DATA_FILE = "data/papers.jsonl"
@@ -24,15 +30,7 @@ def mean_pooling(model_output, attention_mask):
     return sum_embeddings / sum_mask
 
 
-embeddings = []
-metadata = []
-
-with open(DATA_FILE, "r", encoding="utf-8") as f:
-    papers = list(f)
-
-for line in tqdm(papers, desc="Encoding papers"):
-    paper = json.loads(line)
-
+def encode(paper):
     text = paper["title"] + " " + paper["abstract"]
 
     encoded = tokenizer(
@@ -49,10 +47,55 @@ for line in tqdm(papers, desc="Encoding papers"):
         model_output = model(**encoded)
 
     emb = mean_pooling(model_output, encoded["attention_mask"])
-    embeddings.append(emb.cpu().numpy()[0])
-    metadata.append(paper)
+    return emb.cpu().numpy()[0]
 
-embeddings = np.array(embeddings)
+
+parser = argparse.ArgumentParser(description="Encode papers into embeddings")
+parser.add_argument("--append", action="store_true",
+                    help="keep existing rows and only encode papers not yet in the index")
+args = parser.parse_args()
+
+with open(DATA_FILE, "r", encoding="utf-8") as f:
+    papers = [json.loads(line) for line in f]
+
+# In append mode existing rows keep their position, so the neighbour graph
+# and other files derived from the embeddings can be updated incrementally
+metadata = []
+embeddings = np.zeros((0, model.config.hidden_size), dtype=np.float32)
+
+if args.append and os.path.exists(OUTPUT_EMBEDDINGS) and os.path.exists(OUTPUT_META):
+    embeddings = np.load(OUTPUT_EMBEDDINGS)
+    with open(OUTPUT_META, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+
+    known = known_keys(metadata)
+    papers = [paper for paper in papers if not is_known(paper, known)]
+    print(f"Appending to {len(metadata)} indexed papers, {len(papers)} new records")
+
+num_fixed = len(metadata)
+
+# Collapse exact title/DOI matches before encoding, so each work is encoded once
+pool = metadata + papers
+attached, fresh = anchor_groups(group_by_keys(pool), num_fixed)
+for row, members in attached.items():
+    metadata[row] = collapse(pool, [row] + members, canonical=row)
+papers = [collapse(pool, group) for group in fresh]
+print("Unique new papers after title/DOI dedup:", len(papers))
+
+vectors = [encode(paper) for paper in tqdm(papers, desc="Encoding papers")]
+if vectors:
+    embeddings = np.concatenate([embeddings, np.array(vectors, dtype=embeddings.dtype)])
+metadata = metadata + papers
+
+# Collapse remaining near-duplicates (e.g. retitled preprints) by embedding similarity
+groups = group_by_embeddings(embeddings, metadata, query_start=num_fixed)
+attached, fresh = anchor_groups(groups, num_fixed)
+pool = list(metadata)
+for row, members in attached.items():
+    metadata[row] = collapse(pool, [row] + members, canonical=row)
+
+embeddings = embeddings[list(range(num_fixed)) + [pick_canonical(pool, group) for group in fresh]]
+metadata = metadata[:num_fixed] + [collapse(pool, group) for group in fresh]
 
 np.save(OUTPUT_EMBEDDINGS, embeddings)
 
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
@@ -16,6 +17,15 @@ import torch
 from transformers import AutoTokenizer, AutoModel
 from context import ContextManager
 from summarize import summarize_paper
+from knn_graph import (
+    NEIGHBORS_FILE, NEIGHBOR_SCORES_FILE, NEIGHBORS_META_FILE,
+    matches_embeddings, load_graph_meta,
+)
+from dedup import normalize_doi
+from pca_index import (
+    PCA_FILE, REDUCED_EMBEDDINGS_FILE, TOP_K, NUM_CANDIDATES, RESCORE_FACTOR,
+    two_stage_search,
+)
 
 app = FastAPI()
 
@@ -31,7 +41,10 @@ app.add_middleware(
 EMBEDDINGS_FILE = "embeddings/paper_embeddings.npy"
 METADATA_FILE = "embeddings/paper_metadata.json"
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-TOP_K = 3  # Return only top 3 results
+
+# Two-stage search: scan a PCA-reduced index (built by pca_index.py),
+# then rescore the candidates with the full vectors
+TWO_STAGE = os.environ.get("TWO_STAGE_SEARCH", "0") == "1"
 
 device = "cpu"  # Force CPU to save GPU memory overhead
 
@@ -42,6 +55,10 @@ tokenizer = None
 model = None
 context_manager = None
 embeddings = None
+pca_mean = None
+pca_components = None
+# (meta file mtime, neighbors, neighbor_scores, metadata, paper_rows), swapped as a whole on reload
+neighbor_graph = None
 
 
 class SearchRequest(BaseModel):
@@ -53,6 +70,11 @@ class SearchResponse(BaseModel):
     query: str
 
 
+class SimilarResponse(BaseModel):
+    results: list
+    paper_id: str
+
+
 def mean_pooling(model_output, attention_mask):
     token_embeddings = model_output.last_hidden_state
     input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
@@ -77,9 +99,21 @@ def embed_query(text):
     return emb
 
 
+def retrieve(query_vec, k):
+    """Returns (scores, indices) like index.search, with exact inner-product scores"""
+    if pca_components is None:
+        return index.search(query_vec, k)
+    
+    scores, indices = two_stage_search(
+        query_vec, embeddings, index, pca_mean, pca_components, k, RESCORE_FACTOR
+    )
+    return np.array(scores), np.array(indices)
+
+
 def load_models_lazy():
     """Lazy load models only when first request comes in"""
     global index, metadata, tokenizer, model, context_manager, embeddings
+    global pca_mean, pca_components
     
     if index is not None:
         return  # Already loaded
@@ -101,8 +135,33 @@ def load_models_lazy():
         
         embeddings = embeddings_copy
         
-        index = faiss.IndexFlatIP(dim)
-        index.add(embeddings)
+        if TWO_STAGE:
+            if not os.path.exists(PCA_FILE) or not os.path.exists(REDUCED_EMBEDDINGS_FILE):
+                raise FileNotFoundError(f"Two-stage index not found at {PCA_FILE}, run pca_index.py")
+            
+            pca = np.load(PCA_FILE)
+            reduced = np.load(REDUCED_EMBEDDINGS_FILE)
+            
+            # Both files are derived from the embeddings and go stale when the encoder re-runs
+            built_from_current = "fingerprint" in pca.files and matches_embeddings(
+                str(pca["fingerprint"]), pca["stamp"].tolist()
+            )
+            if not built_from_current:
+                raise ValueError("Two-stage index is older than the embeddings, re-run pca_index.py")
+            if pca["components"].shape[1] != dim or reduced.shape[0] != embeddings.shape[0]:
+                raise ValueError(
+                    f"Two-stage index covers {reduced.shape[0]} papers of dim {pca['components'].shape[1]} "
+                    f"but embeddings are {embeddings.shape}, re-run pca_index.py"
+                )
+            
+            pca_mean = pca["mean"]
+            pca_components = pca["components"]
+            
+            index = faiss.IndexFlatIP(reduced.shape[1])
+            index.add(reduced)
+        else:
+            index = faiss.IndexFlatIP(dim)
+            index.add(embeddings)
         
         print(f"FAISS index built with {index.ntotal} vectors")
         
@@ -146,7 +205,7 @@ async def search(request: SearchRequest):
         
         context_manager.add_query(query_vec)
         
-        scores, indices = index.search(query_vec, TOP_K * 5)
+        scores, indices = retrieve(query_vec, NUM_CANDIDATES)
         
         context_vec = context_manager.get_context_vector()
         
@@ -196,6 +255,98 @@ async def search(request: SearchRequest):
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
+def paper_keys(paper):
+    """Lookup keys for /similar: the paper's id and DOI, and those of its collapsed versions"""
+    for version in [paper] + paper.get("versions", []):
+        if version.get("id") is not None:
+            yield str(version["id"])
+        if normalize_doi(version.get("doi")):
+            yield normalize_doi(version.get("doi"))
+
+
+def load_neighbors_lazy():
+    """
+    Memory-map the precomputed neighbour graph built by knn_graph.py,
+    reloading it whenever knn_graph.py has saved a new one
+    """
+    global neighbor_graph
+    
+    for path in (NEIGHBORS_FILE, NEIGHBOR_SCORES_FILE, NEIGHBORS_META_FILE):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Neighbour graph not found at {path}, run knn_graph.py")
+    
+    # knn_graph.py replaces the meta file last, so its mtime marks a finished build
+    mtime = os.stat(NEIGHBORS_META_FILE).st_mtime_ns
+    if neighbor_graph is not None and neighbor_graph[0] == mtime:
+        return  # Already loaded
+    
+    if not os.path.exists(METADATA_FILE):
+        raise FileNotFoundError(f"Metadata file not found at {METADATA_FILE}")
+    
+    # The graph keeps its own copy of the metadata, so it stays consistent
+    # with its rows even while the encoder rewrites the shared files
+    with open(METADATA_FILE, "r", encoding="utf-8") as f:
+        graph_metadata = json.load(f)
+    
+    graph = np.load(NEIGHBORS_FILE, mmap_mode='r')
+    graph_scores = np.load(NEIGHBOR_SCORES_FILE, mmap_mode='r')
+    graph_meta = load_graph_meta()
+    
+    # The graph stores row positions, so it is only valid for the exact embeddings it was built from
+    if not (len(graph) == len(graph_scores) == graph_meta["rows"] == len(graph_metadata)):
+        raise ValueError(
+            f"Neighbour graph has {len(graph)} rows but metadata has {len(graph_metadata)} papers, "
+            "rebuild with knn_graph.py"
+        )
+    if not matches_embeddings(graph_meta["fingerprint"], graph_meta.get("stamp", [])):
+        raise ValueError("Neighbour graph is older than the embeddings, rebuild with knn_graph.py")
+    
+    paper_rows = {}
+    for row, paper in enumerate(graph_metadata):
+        for key in paper_keys(paper):
+            paper_rows.setdefault(key, row)
+    
+    neighbor_graph = (mtime, graph, graph_scores, graph_metadata, paper_rows)
+    
+    print(f"Neighbour graph loaded for {len(graph)} papers")
+
+
+@app.get("/similar/{paper_id:path}", response_model=SimilarResponse)
+async def similar(paper_id: str, k: int = Query(TOP_K, ge=1)):
+    try:
+        # Off the event loop: a reload parses the metadata and may hash the embeddings
+        await run_in_threadpool(load_neighbors_lazy)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=f"Missing required files: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=f"Stale neighbour graph: {str(e)}")
+    
+    _, neighbors, neighbor_scores, graph_metadata, paper_rows = neighbor_graph
+    
+    # Papers are addressed by their id or DOI, or those of any collapsed version
+    row = paper_rows.get(paper_id)
+    if row is None and normalize_doi(paper_id):
+        row = paper_rows.get(normalize_doi(paper_id))
+    
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Unknown paper: {paper_id}")
+    
+    results = []
+    
+    for idx, score in zip(neighbors[row][:k], neighbor_scores[row][:k]):
+        if idx < 0:
+            break  # Padding when the corpus is smaller than the graph width
+        
+        paper = graph_metadata[idx].copy()
+        paper["score"] = float(score)
+        results.append(paper)
+    
+    return SimilarResponse(
+        results=results,
+        paper_id=paper_id
+    )
+
+
 @app.get("/health")
 async def health():
     return {